@@ -1,15 +1,26 @@
 import argparse
 import array
 import asyncio
+import collections
+import concurrent.futures
+import errno
 import functools
 import glob
+import itertools
+import json
 import logging
+import mmap
 import os
+import select
 import shutil
 import signal
 import stat
 import sys
 import sysconfig
+import tempfile
+import threading
+import time
+import zlib
 
 try:
     asyncio_run = asyncio.run
@@ -55,6 +66,39 @@ __project_urls__ = (("Bug Tracker", "https://github.com/pipebus/filebus/issues")
 
 BUFSIZE = 4096
 SLEEP_INTERVAL = 0.1
+WRITE_QUEUE_DEPTH = 1
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+SPOOL_SEGMENT_SIZE = 4 * 1024 * 1024
+MAX_RECORD_SIZE = 1024 * 1024
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 1.0
+OUTPUT_POLICIES = ("drop", "drop-old")
+OUTPUT_DRAIN_TIMEOUT = 10
+STALL_THRESHOLD = 0.05
+
+# Identifies the doorbells of this process, so that it does not ring
+# them itself. The pid alone may collide across pid namespaces which
+# share a bus directory.
+DOORBELL_TOKEN = "{}-{}".format(os.getpid(), os.urandom(4).hex())
+
+TRACE_STAGES = (
+    "read",
+    "flush_start",
+    "lock_acquired",
+    "renamed",
+    "observed",
+    "written",
+)
+TRACE_BUCKETS = (
+    (1e-5, "<10us"),
+    (1e-4, "<100us"),
+    (1e-3, "<1ms"),
+    (1e-2, "<10ms"),
+    (1e-1, "<100ms"),
+    (1.0, "<1s"),
+    (10.0, "<10s"),
+    (float("inf"), ">=10s"),
+)
 
 
 class ModifiedFileHandler(FileSystemEventHandler):
@@ -67,10 +111,551 @@ class ModifiedFileHandler(FileSystemEventHandler):
         self.filebus_callback(event)
 
 
+def chunk_key(st):
+    """
+    Identify a published chunk by the device, inode and mtime of its file,
+    which are visible to both producers and consumers.
+    """
+    return "{}:{}:{}".format(st.st_dev, st.st_ino, st.st_mtime_ns)
+
+
+class ChunkTracer:
+    """
+    Append per-chunk stage timestamps and event loop stalls to a JSON-lines
+    trace file. The file is opened in append mode with line buffering, so
+    producers and consumers may safely share a single trace file.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, mode="at", buffering=1)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def chunk(self, role, st, size, stages):
+        self._write(
+            {
+                "chunk": chunk_key(st),
+                "pid": self._pid,
+                "role": role,
+                "size": size,
+                "stages": stages,
+            }
+        )
+
+    def stall(self, duration):
+        self._write({"pid": self._pid, "stall": duration, "t": time.time()})
+
+    def _write(self, record):
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        self._file.close()
+
+
+class Doorbell:
+    """
+    A FIFO in the FILENAME.notify directory of each of the given bus
+    files, which is rung by ring_doorbells after the bus file is updated.
+    Each waiter owns a separate FIFO, so that every waiter is woken by a
+    single ring, and a FIFO is hard linked into the directory of every
+    bus file that its waiter waits for.
+    """
+
+    _counter = itertools.count()
+
+    def __init__(self, filenames):
+        self._dirnames = [filename + ".notify" for filename in filenames]
+        self._name = "{}.{}".format(DOORBELL_TOKEN, next(self._counter))
+        self._fd = None
+
+    def open(self):
+        # Create the FIFO under a hidden name and open it before it is
+        # renamed into place, since ring_doorbells removes FIFOs without a
+        # reader.
+        tmp_path = os.path.join(self._dirnames[0], "." + self._name)
+        self._retry_makedirs(self._dirnames[0], os.mkfifo, tmp_path)
+        # O_RDWR prevents a POLLHUP busy loop when no writer is connected.
+        self._fd = os.open(tmp_path, os.O_RDWR | os.O_NONBLOCK)
+        for dirname in self._dirnames[1:]:
+            self._retry_makedirs(
+                dirname, os.link, tmp_path, os.path.join(dirname, self._name)
+            )
+        os.rename(tmp_path, os.path.join(self._dirnames[0], self._name))
+
+    @staticmethod
+    def _retry_makedirs(dirname, func, *args):
+        # Another process removes the directory when it becomes empty,
+        # so create it again if it disappears before func is done.
+        while True:
+            os.makedirs(dirname, exist_ok=True)
+            try:
+                return func(*args)
+            except FileNotFoundError:
+                continue
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            for dirname in self._dirnames:
+                try:
+                    os.unlink(os.path.join(dirname, self._name))
+                except FileNotFoundError:
+                    pass
+                try:
+                    os.rmdir(dirname)
+                except OSError as e:
+                    # Other waiters still use the directory.
+                    if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                        raise
+
+    def _drain(self):
+        try:
+            while os.read(self._fd, BUFSIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+    async def wait(self, timeout):
+        loop = get_running_loop()
+        rung = loop.create_future()
+        loop.add_reader(self._fd, lambda: rung.done() or rung.set_result(None))
+        try:
+            await asyncio.wait([rung], timeout=timeout)
+        finally:
+            loop.remove_reader(self._fd)
+        self._drain()
+
+    def wait_blocking(self, timeout):
+        select.select([self._fd], [], [], timeout)
+        self._drain()
+
+
+def ring_doorbells(filename):
+    """
+    Ring the doorbells of the given bus file, except for those of this
+    process, which never waits for its own updates.
+    """
+    dirname = filename + ".notify"
+    try:
+        names = os.listdir(dirname)
+    except FileNotFoundError:
+        return
+    own_prefix = DOORBELL_TOKEN + "."
+    for name in names:
+        if name.startswith(".") or name.startswith(own_prefix):
+            continue
+        path = os.path.join(dirname, name)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            # The waiter exited without removing its FIFO.
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            os.write(fd, b"\0")
+        except BlockingIOError:
+            # The FIFO is full of unanswered rings already.
+            pass
+        finally:
+            os.close(fd)
+
+
+def partition_filename(filename, index):
+    return "{}.{}".format(filename, index)
+
+
+def partition_key_func(args):
+    """
+    Return a function which extracts the partition key from a record,
+    according to the --partition-key-field or --partition-key-bytes
+    arguments. By default, the whole record is the key.
+    """
+    delimiter = args.record_delimiter
+
+    def strip_delimiter(record):
+        return record[: -len(delimiter)] if record.endswith(delimiter) else record
+
+    if args.partition_key_field is not None:
+
+        def key_func(record):
+            fields = strip_delimiter(record).split(args.partition_field_delimiter)
+            if args.partition_key_field < len(fields):
+                return fields[args.partition_key_field]
+            return b""
+
+        return key_func
+
+    if args.partition_key_bytes is not None:
+        start, end = args.partition_key_bytes
+        return lambda record: strip_delimiter(record)[start:end]
+
+    return strip_delimiter
+
+
+def partition_index(key, partitions):
+    """
+    Map a key to a partition with a hash that is stable across processes.
+    The low bits of crc32 are linear in the input, so they are mixed by a
+    multiplicative hash before the high bits select the partition.
+    """
+    return ((zlib.crc32(key) * 0x9E3779B1) & 0xFFFFFFFF) * partitions >> 32
+
+
+def partition_records(data, delimiter, partitions, key_func):
+    """
+    Split data into records terminated by delimiter, and route each record
+    to a partition by a hash of its key. The order of records is preserved
+    within each partition.
+    """
+    chunks = [bytearray() for _ in range(partitions)]
+    start = 0
+    while start < len(data):
+        end = data.find(delimiter, start)
+        end = len(data) if end == -1 else end + len(delimiter)
+        record = data[start:end]
+        chunks[partition_index(key_func(record), partitions)] += record
+        start = end
+    return chunks
+
+
+class SpoolSegment:
+    def __init__(self, dirname):
+        self.file = tempfile.TemporaryFile(dir=dirname, prefix="filebus-spool-")
+        self.end = 0
+        self.pending = 0
+
+
+class Spool:
+    """
+    A queue of chunks in a chain of unlinked temporary segment files,
+    which absorbs input while the back pressure protocol blocks. Chunks
+    are appended sequentially by a dedicated spool thread and read back
+    via mmap by the writer thread. A segment is closed, which frees its
+    disk space, as soon as all of its chunks have been read and a newer
+    segment has been started, so that disk usage is bounded by the queue
+    size plus two segments.
+    """
+
+    def __init__(self, dirname, segment_size=SPOOL_SEGMENT_SIZE):
+        self._dirname = dirname
+        self._segment_size = segment_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # The lock only protects the queue state, and it is never held
+        # during I/O.
+        self._lock = threading.Lock()
+        self._segments = collections.deque()
+        self._chunks = collections.deque()
+        self.size = 0
+
+    def append(self, data):
+        """
+        Queue data to be written by the spool thread, and return a future
+        which must be passed to pop.
+        """
+        with self._lock:
+            self.size += len(data)
+        return self._executor.submit(self._write, data)
+
+    def _write(self, data):
+        with self._lock:
+            segment = self._segments[-1] if self._segments else None
+            if segment is not None and segment.end >= self._segment_size:
+                segment = None
+        if segment is None:
+            segment = SpoolSegment(self._dirname)
+            with self._lock:
+                self._segments.append(segment)
+        offset = end = segment.end
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(segment.file.fileno(), view, end)
+            view = view[written:]
+            end += written
+        with self._lock:
+            segment.end = end
+            segment.pending += 1
+            self._chunks.append((segment, offset, len(data)))
+
+    def pop(self, append_future):
+        """
+        Wait for the oldest chunk to be written, and return its data.
+        """
+        append_future.result()
+        with self._lock:
+            segment, offset, length = self._chunks.popleft()
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(
+            segment.file.fileno(),
+            offset + length - start,
+            access=mmap.ACCESS_READ,
+            offset=start,
+        ) as spool_map:
+            data = spool_map[offset - start :]
+        with self._lock:
+            self.size -= length
+            segment.pending -= 1
+            # The spool thread never appends to a full segment.
+            retired = not segment.pending and segment.end >= self._segment_size
+            if retired:
+                self._segments.remove(segment)
+        if retired:
+            segment.file.close()
+        return data
+
+    def disk_size(self):
+        with self._lock:
+            segments = list(self._segments)
+        return sum(os.fstat(segment.file.fileno()).st_size for segment in segments)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for segment in self._segments:
+            segment.file.close()
+        self._segments.clear()
+        self._chunks.clear()
+
+
+class Sink:
+    """
+    A consumer output with a bounded buffer, which is written without
+    blocking so that a slow sink cannot hold back other sinks. When the
+    buffer is full, the "drop" policy discards new chunks, and the
+    "drop-old" policy discards the oldest buffered chunks.
+    """
+
+    def __init__(self, target, policy, max_bytes):
+        self.target = target
+        self.policy = policy
+        self.closed = False
+        self._max_bytes = max_bytes
+        self._buffer = collections.deque()
+        self._size = 0
+        self._dropped = 0
+        self._discarded = 0
+        self._fd = None
+        self._fd_flags = None
+        self._loop = None
+        self._progress = None
+
+    def open(self):
+        if self.target.isdigit():
+            self._fd = int(self.target)
+        else:
+            # Like a shell redirection, this waits for a FIFO reader.
+            self._fd = os.open(
+                self.target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666
+            )
+        self._fd_flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._fd, fcntl.F_SETFL, self._fd_flags | os.O_NONBLOCK)
+
+    def close(self):
+        if self._fd is None:
+            return
+        if self._loop is not None:
+            self._loop.remove_writer(self._fd)
+            self._loop = None
+        if self._dropped:
+            logging.warning(
+                "output %s dropped %d bytes due to a full buffer",
+                self.target,
+                self._dropped,
+            )
+        if self._discarded:
+            logging.warning(
+                "output %s discarded %d bytes after the drain timeout",
+                self.target,
+                self._discarded,
+            )
+        if self.target.isdigit():
+            fcntl.fcntl(self._fd, fcntl.F_SETFL, self._fd_flags)
+        else:
+            os.close(self._fd)
+        self._fd = None
+        self.closed = True
+        self._notify_progress()
+
+    def has_room(self):
+        return self._size < self._max_bytes
+
+    def write(self, data):
+        if self.closed:
+            return
+        if not self.has_room():
+            if self.policy == "drop":
+                self._dropped += len(data)
+                return
+            # The chunk at the head may be partially written already,
+            # so it is never dropped.
+            while len(self._buffer) > 1 and not self.has_room():
+                dropped = self._buffer[1]
+                del self._buffer[1]
+                self._size -= len(dropped)
+                self._dropped += len(dropped)
+        self._buffer.append(memoryview(data))
+        self._size += len(data)
+        if self._loop is None:
+            self._write_ready()
+
+    def _write_ready(self):
+        try:
+            while self._buffer:
+                written = os.write(self._fd, self._buffer[0])
+                self._size -= written
+                if written == len(self._buffer[0]):
+                    self._buffer.popleft()
+                else:
+                    self._buffer[0] = self._buffer[0][written:]
+        except BlockingIOError:
+            if self._loop is None:
+                self._loop = get_running_loop()
+                self._loop.add_writer(self._fd, self._write_ready)
+        except BrokenPipeError:
+            logging.warning("output %s closed by reader", self.target)
+            self._buffer.clear()
+            self._size = 0
+            self.close()
+            return
+        else:
+            if self._loop is not None:
+                self._loop.remove_writer(self._fd)
+                self._loop = None
+        self._notify_progress()
+
+    def _notify_progress(self):
+        progress, self._progress = self._progress, None
+        if progress is not None and not progress.done():
+            progress.set_result(None)
+
+    def progress(self):
+        """
+        Return a future which is done when the buffer shrinks or the sink
+        is closed. The same future is shared by all waiters.
+        """
+        if self._progress is None:
+            self._progress = get_running_loop().create_future()
+        return self._progress
+
+    async def drain(self, timeout=None):
+        """
+        Wait for the buffer to be written, and discard it if the sink
+        makes no progress for timeout seconds. If timeout is None, then
+        wait indefinitely.
+        """
+        while self._buffer and not self.closed:
+            done, _pending = await asyncio.wait([self.progress()], timeout=timeout)
+            if not done:
+                logging.warning(
+                    "output %s made no progress for %s seconds, discarding %d bytes",
+                    self.target,
+                    timeout,
+                    self._size,
+                )
+                self._discarded += self._size
+                self._buffer.clear()
+                self._size = 0
+                return
+
+
+class FileRange:
+    """
+    A range of a regular file which is published as a chunk by copying
+    it in the kernel, without passing it through a userspace buffer.
+    """
+
+    # Copy methods which failed with an errno indicating that the source
+    # and destination do not support them.
+    _unsupported = set()
+
+    def __init__(self, fd, offset, length):
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def _copy(self, out_fd, offset, count):
+        # copy_file_range allows filesystems such as btrfs and XFS to
+        # share extents (reflink) instead of copying data.
+        if "copy_file_range" not in self._unsupported and hasattr(
+            os, "copy_file_range"
+        ):
+            try:
+                return os.copy_file_range(self.fd, out_fd, count, offset)
+            except OSError as e:
+                if e.errno not in (
+                    errno.EXDEV,
+                    errno.EINVAL,
+                    errno.ENOSYS,
+                    errno.EOPNOTSUPP,
+                ):
+                    raise
+                self._unsupported.add("copy_file_range")
+        if "sendfile" not in self._unsupported and hasattr(os, "sendfile"):
+            try:
+                return os.sendfile(out_fd, self.fd, offset, count)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                self._unsupported.add("sendfile")
+        data = os.pread(self.fd, min(count, BUFSIZE * 16), offset)
+        return os.write(out_fd, data) if data else 0
+
+    def copy_to(self, out_fd):
+        copied = 0
+        while copied < self.length:
+            count = self._copy(out_fd, self.offset + copied, self.length - copied)
+            if not count:
+                # The file was truncated.
+                break
+            copied += count
+        return copied
+
+
+class PartitionWriter:
+    """
+    The writer thread and queues which publish chunks to one bus file. A
+    single writer thread publishes chunks in the order that they were
+    queued, which preserves the order of records within a partition.
+    """
+
+    def __init__(self, filename, spool=None, doorbell=None):
+        self.filename = filename
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pending = collections.deque()
+        self.spool = spool
+        self.doorbell = doorbell
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.spool is not None:
+            self.spool.close()
+        if self.doorbell is not None:
+            self.doorbell.close()
+
+
 class FileBus:
     def __init__(self, args):
         self._args = args
-        self._file_modified_future = None
+        self._file_modified_futures = {}
+        self._chunk_read_time = None
+        self._record_scan_offset = 0
+        self._bulk_ingest_end = None
+        self._tracer = None
+        self._writers = []
+        self._writer_stop = threading.Event()
+        self._doorbells = {}
+        self._sinks = []
 
     @property
     def _file_monitoring(self):
@@ -78,17 +663,134 @@ class FileBus:
             self._args.file_monitoring
             and watchdog is not None
             and not self._args.back_pressure
+            and not self._args.notify
         )
 
     def __enter__(self):
+        if getattr(self._args, "trace", None):
+            self._tracer = ChunkTracer(self._args.trace)
+        if self._args.command == "producer":
+            for filename in self._bus_filenames():
+                writer = PartitionWriter(filename)
+                if self._args.back_pressure and self._args.spool_dir:
+                    writer.spool = Spool(self._args.spool_dir)
+                if self._args.back_pressure and self._args.notify:
+                    writer.doorbell = Doorbell([filename])
+                    writer.doorbell.open()
+                self._writers.append(writer)
+            # A lossy producer never waits, so it only rings doorbells.
+            # Otherwise, the event loop waits for any partition to accept
+            # a chunk.
+            wait_filenames = {}
+            if self._args.back_pressure:
+                wait_filenames[self._args.filename] = self._bus_filenames()
+        else:
+            wait_filenames = {
+                filename: [filename] for filename in self._consumer_filenames()
+            }
+            for policy, target in self._args.output or ():
+                sink = Sink(target, policy, self._args.output_buffer_size)
+                self._sinks.append(sink)
+                sink.open()
+        if self._args.notify:
+            for filename, bus_filenames in wait_filenames.items():
+                self._doorbells[filename] = Doorbell(bus_filenames)
+                self._doorbells[filename].open()
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._writer_stop.set()
+        for writer in self._writers:
+            writer.close()
+        self._writers = []
+        for doorbell in self._doorbells.values():
+            doorbell.close()
+        self._doorbells = {}
+        for sink in self._sinks:
+            sink.close()
+        self._sinks = []
+        if self._tracer is not None:
+            self._tracer.close()
+            self._tracer = None
         return False
 
+    def _bus_filenames(self):
+        if not self._args.partitions:
+            return [self._args.filename]
+        return [
+            partition_filename(self._args.filename, i)
+            for i in range(self._args.partitions)
+        ]
+
+    def _consumer_filenames(self):
+        if self._args.partitions and self._args.partition:
+            return [
+                partition_filename(self._args.filename, i)
+                for i in self._args.partition
+            ]
+        return self._bus_filenames()
+
     async def io_loop(self):
         command_loop = getattr(self, self._args.command + "_loop")
-        await command_loop()
+        stall_threshold = getattr(self._args, "stall_threshold", None)
+        if stall_threshold is None and self._tracer is not None:
+            stall_threshold = STALL_THRESHOLD
+        stall_detector = None
+        if stall_threshold is not None:
+            stall_detector = asyncio.ensure_future(
+                self._stall_detector(stall_threshold)
+            )
+        try:
+            await command_loop()
+        finally:
+            if stall_detector is not None:
+                stall_detector.cancel()
+
+    async def _stall_detector(self, threshold):
+        """
+        Periodically sleep for half of the threshold, and report an event
+        loop stall whenever the wakeup is late by at least the threshold.
+        """
+        loop = get_running_loop()
+        interval = threshold / 2
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            stall = loop.time() - expected
+            if stall >= threshold:
+                logging.warning("event loop stalled for %.6f seconds", stall)
+                if self._tracer is not None:
+                    self._tracer.stall(stall)
+
+    def _ring(self, filename):
+        if self._args.notify:
+            ring_doorbells(filename)
+
+    async def _wait_for_update(self, filename):
+        doorbell = self._doorbells.get(filename)
+        if doorbell is None:
+            await asyncio.sleep(self._args.sleep_interval)
+        else:
+            await doorbell.wait(self._args.sleep_interval)
+
+    def _writer_wait_for_update(self, writer):
+        """
+        Wait for an update from the writer thread, and return True if
+        the writer thread should stop.
+        """
+        if writer.doorbell is None:
+            return self._writer_stop.wait(self._args.sleep_interval)
+        writer.doorbell.wait_blocking(self._args.sleep_interval)
+        return self._writer_stop.is_set()
+
+    def _trace_stages(self):
+        if self._tracer is None:
+            return None
+        stages = {"flush_start": time.time()}
+        if self._chunk_read_time is not None:
+            stages["read"] = self._chunk_read_time
+        self._chunk_read_time = None
+        return stages
 
     def _stdin_read(self, stdin, stdin_buffer, new_bytes, eof):
         try:
@@ -96,6 +798,8 @@ class FileBus:
         except EnvironmentError:
             result = None
         if result:
+            if self._tracer is not None and not stdin_buffer:
+                self._chunk_read_time = time.time()
             stdin_buffer.extend(result)
         if not new_bytes.done():
             new_bytes.set_result(bool(result))
@@ -104,38 +808,248 @@ class FileBus:
         if eof.done():
             get_running_loop().remove_reader(stdin.fileno())
 
-    def _lock_filename(self):
-        lock = filelock.FileLock(self._args.filename + ".lock")
+    def _lock_filename(self, filename):
+        lock = filelock.FileLock(filename + ".lock")
         lock.acquire()
         return lock
 
-    async def _flush_buffer(self, stdin_buffer):
-
+    def _write_chunk(self, filename, stdin_bytes, stages=None):
+        """
+        Publish a chunk while the lock is held, and return True if the bus
+        file was replaced, so that the caller rings the doorbells after it
+        releases the lock.
+        """
+        if isinstance(stdin_bytes, FileRange) and self._bulk_ingest_end is not None:
+            # The read loop publishes the rest of a truncated file.
+            return False
+        new_filename = filename + ".__new__"
+        with open(new_filename, mode="wb") as new_file:
+            if isinstance(stdin_bytes, FileRange):
+                size = stdin_bytes.copy_to(new_file.fileno())
+                if size < len(stdin_bytes):
+                    self._bulk_ingest_end = stdin_bytes.offset + size
+            else:
+                size = len(stdin_bytes)
+                new_file.write(stdin_bytes)
+        if not size:
+            # An empty chunk would be mistaken for the EOF marker.
+            os.unlink(new_filename)
+            return False
+        if stages is not None:
+            st = os.stat(new_filename)
+        os.rename(new_filename, filename)
+        if stages is not None:
+            stages["renamed"] = time.time()
+            self._tracer.chunk("producer", st, size, stages)
+        return True
+
+    def _publish_chunk(self, writer, stdin_bytes, stages):
+        """
+        Publish a chunk from the writer thread, so that slow filesystem
+        operations do not prevent the event loop from reading stdin.
+        """
         if self._args.back_pressure:
             while True:
-                while os.path.exists(self._args.filename):
+                while os.path.exists(writer.filename):
                     # FIXME: support file monitoring
-                    await asyncio.sleep(self._args.sleep_interval)
-                with self._lock_filename() as lock:
-                    if os.path.exists(self._args.filename):
+                    if self._writer_wait_for_update(writer):
+                        return
+                with self._lock_filename(writer.filename) as lock:
+                    if os.path.exists(writer.filename):
                         lock.release(force=True)
                         continue
 
-                    stdin_bytes = stdin_buffer.tobytes()
-                    del stdin_buffer[:]
-                    with open(self._args.filename + ".__new__", mode="wb") as new_file:
-                        new_file.write(stdin_bytes)
-                    os.rename(self._args.filename + ".__new__", self._args.filename)
+                    if stages is not None:
+                        stages["lock_acquired"] = time.time()
+                    if writer.spool is not None:
+                        stdin_bytes = writer.spool.pop(stdin_bytes)
+                    published = self._write_chunk(writer.filename, stdin_bytes, stages)
                     lock.release(force=True)
+                    if published:
+                        self._ring(writer.filename)
                     return
 
-        with self._lock_filename() as lock:
+        with self._lock_filename(writer.filename) as lock:
+            if stages is not None:
+                stages["lock_acquired"] = time.time()
+            published = self._write_chunk(writer.filename, stdin_bytes, stages)
+            lock.release(force=True)
+        if published:
+            self._ring(writer.filename)
+
+    async def _flush_buffer(self, stdin_buffer, final=False):
+        # Swap buffers, so that the event loop can continue to fill
+        # stdin_buffer while the writer threads publish stdin_bytes.
+        if self._args.partitions and not final:
+            # Only route complete records, since the key of an
+            # incomplete record may not have been read yet. The part of
+            # the buffer which has already been searched for a delimiter
+            # is not searched again.
+            delimiter = self._args.record_delimiter
+            scan_start = max(0, self._record_scan_offset - len(delimiter) + 1)
+            with memoryview(stdin_buffer) as view:
+                end = view[scan_start:].tobytes().rfind(delimiter)
+            if end != -1:
+                end += scan_start + len(delimiter)
+            elif len(stdin_buffer) < self._args.max_record_size:
+                self._record_scan_offset = len(stdin_buffer)
+                return
+            else:
+                logging.warning(
+                    "flushing %d bytes without a record delimiter (see --max-record-size)",
+                    len(stdin_buffer),
+                )
+                end = len(stdin_buffer)
+            with memoryview(stdin_buffer) as view:
+                stdin_bytes = view[:end].tobytes()
+            del stdin_buffer[:end]
+        else:
             stdin_bytes = stdin_buffer.tobytes()
             del stdin_buffer[:]
-            with open(self._args.filename + ".__new__", mode="wb") as new_file:
-                new_file.write(stdin_bytes)
-            os.rename(self._args.filename + ".__new__", self._args.filename)
-            lock.release(force=True)
+        # The remainder of the buffer follows the last delimiter.
+        self._record_scan_offset = len(stdin_buffer)
+
+        stages = self._trace_stages()
+        if not self._args.partitions:
+            await self._queue_chunk(self._writers[0], stdin_bytes, stages)
+            return
+
+        chunks = partition_records(
+            stdin_bytes,
+            self._args.record_delimiter,
+            len(self._writers),
+            partition_key_func(self._args),
+        )
+        for writer, chunk in zip(self._writers, chunks):
+            if chunk:
+                await self._queue_chunk(
+                    writer, bytes(chunk), None if stages is None else dict(stages)
+                )
+
+    async def _queue_chunk(self, writer, stdin_bytes, stages):
+        if writer.spool is not None:
+            # The writer thread will pop the chunk from the spool when
+            # the back pressure protocol allows it to be published. The
+            # spool thread writes it to disk in the meantime.
+            stdin_bytes = writer.spool.append(stdin_bytes)
+        writer.pending.append(
+            get_running_loop().run_in_executor(
+                writer.executor, self._publish_chunk, writer, stdin_bytes, stages
+            )
+        )
+        while writer.pending and writer.pending[0].done():
+            await writer.pending.popleft()
+        if writer.spool is None:
+            while len(writer.pending) > self._args.write_queue_depth:
+                await writer.pending.popleft()
+
+    def _producer_blocked(self):
+        """
+        Return True if no partition can accept another chunk until a
+        consumer relieves back pressure.
+        """
+        for writer in self._writers:
+            if (
+                writer.spool is not None
+                and writer.spool.size < self._args.spool_max_bytes
+            ):
+                return False
+            if not os.path.exists(writer.filename):
+                return False
+        return True
+
+    async def _drain_writes(self):
+        for writer in self._writers:
+            while writer.pending:
+                await writer.pending.popleft()
+
+    async def _write_eof(self, filename):
+        loop = get_running_loop()
+        while not loop.is_closed():
+            try:
+                os.stat(filename)
+            except FileNotFoundError:
+                with self._lock_filename(filename) as lock:
+                    if os.path.exists(filename):
+                        # Too late to report EOF.
+                        lock.release(force=True)
+                        return
+                    # Write an empty buffer to indicate EOF.
+                    with open(filename + ".__new__", "wb"):
+                        pass
+                    os.rename(filename + ".__new__", filename)
+                    lock.release(force=True)
+                self._ring(filename)
+                break
+            else:
+                # FIXME: support file monitoring
+                await self._wait_for_update(self._args.filename)
+                continue
+
+    def _bulk_ingest_enabled(self, stdin_st):
+        return (
+            self._args.bulk_ingest
+            and stat.S_ISREG(stdin_st.st_mode)
+            # Files such as those in procfs and sysfs report a size of 0.
+            and stdin_st.st_size > 0
+            and not self._args.partitions
+            and self._writers[0].spool is None
+        )
+
+    async def _bulk_ingest(self, stdin):
+        """
+        Publish a regular file stdin by copying block sized ranges of it
+        directly into the staging files, which preserves the chunk
+        boundaries of the read loop. Return False if the file was
+        truncated, in which case the read loop continues where the copy
+        stopped.
+        """
+        loop = get_running_loop()
+        fd = stdin.fileno()
+        start = offset = os.lseek(fd, 0, os.SEEK_CUR)
+        start_time = progress_time = loop.time()
+        while not loop.is_closed() and self._bulk_ingest_end is None:
+            # Check the size of each chunk, in case the file is growing.
+            size = os.fstat(fd).st_size
+            if offset >= size:
+                break
+            if self._args.back_pressure and self._producer_blocked():
+                await self._wait_for_update(self._args.filename)
+                continue
+
+            length = min(self._args.block_size, size - offset)
+            if self._tracer is not None:
+                self._chunk_read_time = time.time()
+            await self._queue_chunk(
+                self._writers[0], FileRange(fd, offset, length), self._trace_stages()
+            )
+            offset += length
+
+            if loop.time() - progress_time >= PROGRESS_INTERVAL:
+                progress_time = loop.time()
+                logging.info(
+                    "bulk ingest: %d of %d bytes (%.1f MiB/s)",
+                    offset - start,
+                    size - start,
+                    (offset - start) / (progress_time - start_time) / 2 ** 20,
+                )
+
+        await self._drain_writes()
+        truncated = self._bulk_ingest_end is not None
+        if truncated:
+            offset = self._bulk_ingest_end
+            logging.warning(
+                "bulk ingest: input truncated at %d bytes, continuing with reads",
+                offset,
+            )
+        # Leave the file offset where a read loop would have left it.
+        os.lseek(fd, offset, os.SEEK_SET)
+        logging.info(
+            "bulk ingest: %d bytes in %.3f seconds",
+            offset - start,
+            loop.time() - start_time,
+        )
+        return not truncated
 
     async def producer_loop(self):
 
@@ -182,17 +1096,16 @@ class FileBus:
                 loop.remove_reader(stdin.fileno())
 
         eof = loop.create_future()
+        if self._bulk_ingest_enabled(stdin_st):
+            if await self._bulk_ingest(stdin):
+                eof.set_result(b"")
+
         while not (loop.is_closed() or eof.done()):
 
-            if self._args.back_pressure:
-                try:
-                    os.stat(self._args.filename)
-                except FileNotFoundError:
-                    pass
-                else:
-                    # FIXME: support file monitoring
-                    await asyncio.sleep(self._args.sleep_interval)
-                    continue
+            if self._args.back_pressure and self._producer_blocked():
+                # FIXME: support file monitoring
+                await self._wait_for_update(self._args.filename)
+                continue
 
             new_bytes = loop.create_future()
             if async_read:
@@ -226,78 +1139,114 @@ class FileBus:
                     new_bytes.done() or new_bytes.cancel()
 
         if stdin_buffer:
-            await self._flush_buffer(stdin_buffer)
+            await self._flush_buffer(stdin_buffer, final=True)
+        # Wait for queued chunks to be published before the EOF marker.
+        await self._drain_writes()
 
         # Write the EOF buffer.
         if self._args.back_pressure:
-            while not loop.is_closed():
-                try:
-                    os.stat(self._args.filename)
-                except FileNotFoundError:
-                    with self._lock_filename() as lock:
-                        if os.path.exists(self._args.filename):
-                            # Too late to report EOF.
-                            lock.release(force=True)
-                            return
-                        # Write an empty buffer to indicate EOF.
-                        with open(self._args.filename + ".__new__", "wb"):
-                            pass
-                        os.rename(self._args.filename + ".__new__", self._args.filename)
-                        lock.release(force=True)
-                        break
-                else:
-                    # FIXME: support file monitoring
-                    await asyncio.sleep(self._args.sleep_interval)
-                    continue
+            for writer in self._writers:
+                await self._write_eof(writer.filename)
 
-    def _file_modified_callback(self, event):
-        self._file_modified_future is None or self._file_modified_future.done() or self._file_modified_future.set_result(
+    def _file_modified_callback(self, filename, event):
+        file_modified_future = self._file_modified_futures.get(filename)
+        file_modified_future is None or file_modified_future.done() or file_modified_future.set_result(
             True
         )
         logging.debug("Modified: %s", event.src_path)
 
+    def _trace_consumed(self, st, size, observed):
+        if self._tracer is not None:
+            self._tracer.chunk(
+                "consumer",
+                st,
+                size,
+                {"observed": observed, "written": time.time()},
+            )
+
+    def _output(self, content):
+        try:
+            if not self._sinks:
+                sys.stdout.buffer.write(content)
+                sys.stdout.buffer.flush()
+                return
+            # Each chunk is read once and buffered for every sink.
+            for sink in self._sinks:
+                sink.write(content)
+            if all(sink.closed for sink in self._sinks):
+                raise BrokenPipeError("all outputs closed")
+        except BrokenPipeError:
+            signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGPIPE)
+            raise
+
+    async def _wait_for_sinks(self):
+        """
+        Wait until at least one sink has room for another chunk, so that
+        the fastest sink sets the pace and slower sinks drop chunks.
+        """
+        while True:
+            sinks = [sink for sink in self._sinks if not sink.closed]
+            if not sinks or any(sink.has_room() for sink in sinks):
+                return
+            await asyncio.wait(
+                [sink.progress() for sink in sinks],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
     async def consumer_loop(self):
+        await asyncio.gather(
+            *(self._consume(filename) for filename in self._consumer_filenames())
+        )
+        # The back pressure protocol is lossless, so it waits for stuck
+        # outputs indefinitely.
+        drain_timeout = (
+            None if self._args.back_pressure else self._args.output_drain_timeout
+        )
+        for sink in self._sinks:
+            await sink.drain(drain_timeout)
+
+    async def _consume(self, filename):
         loop = get_running_loop()
         observer = None
 
         try:
             previous_st = None
             while True:
+                await self._wait_for_sinks()
                 if self._file_monitoring and observer is not None:
-                    self._file_modified_future = loop.create_future()
+                    self._file_modified_futures[filename] = loop.create_future()
                 else:
-                    self._file_modified_future = None
+                    self._file_modified_futures[filename] = None
 
                 try:
-                    st = os.stat(self._args.filename)
+                    st = os.stat(filename)
                 except FileNotFoundError:
                     pass
                 else:
+                    observed = None if self._tracer is None else time.time()
                     if self._args.back_pressure:
-                        with self._lock_filename() as lock:
+                        with self._lock_filename(filename) as lock:
                             try:
-                                fileobj = open(self._args.filename, "rb")
+                                fileobj = open(filename, "rb")
                             except FileNotFoundError:
                                 lock.release(force=True)
                                 continue
                             with fileobj:
+                                st = os.fstat(fileobj.fileno())
                                 content = fileobj.read()
                             if content:
-                                try:
-                                    sys.stdout.buffer.write(content)
-                                    sys.stdout.buffer.flush()
-                                except BrokenPipeError:
-                                    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
-                                    os.kill(os.getpid(), signal.SIGPIPE)
-                                    raise
+                                self._output(content)
+                                self._trace_consumed(st, len(content), observed)
 
                             # remove the file in order relieve back pressure
-                            os.unlink(self._args.filename)
+                            os.unlink(filename)
                             lock.release(force=True)
-                            if not content:
-                                # EOF marker for back pressure protocol
-                                return
-                            continue
+                        self._ring(filename)
+                        if not content:
+                            # EOF marker for back pressure protocol
+                            return
+                        continue
 
                     # The observer will raise a FileNotFoundError if the file does not exist
                     # yet, so we do not start it until the above os.stat call succeeds.
@@ -308,9 +1257,10 @@ class FileBus:
                                 functools.partial(
                                     loop.call_soon_threadsafe,
                                     self._file_modified_callback,
+                                    filename,
                                 )
                             ),
-                            self._args.filename,
+                            filename,
                         )
                         observer.start()
 
@@ -319,33 +1269,30 @@ class FileBus:
                         and previous_st.st_ino == st.st_ino
                         and previous_st.st_dev == st.st_dev
                     ):
-                        with self._lock_filename() as lock:
-                            if not os.path.exists(self._args.filename):
+                        with self._lock_filename(filename) as lock:
+                            if not os.path.exists(filename):
                                 lock.release(force=True)
                                 # FIXME: support file monitoring
-                                await asyncio.sleep(self._args.sleep_interval)
+                                await self._wait_for_update(filename)
                                 continue
 
-                            with open(self._args.filename, "rb") as fileobj:
+                            with open(filename, "rb") as fileobj:
                                 st = os.fstat(fileobj.fileno())
 
                                 previous_st = st
-                                try:
-                                    sys.stdout.buffer.write(fileobj.read())
-                                    sys.stdout.buffer.flush()
-                                except BrokenPipeError:
-                                    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
-                                    os.kill(os.getpid(), signal.SIGPIPE)
-                                    raise
+                                content = fileobj.read()
+                                self._output(content)
+                                self._trace_consumed(st, len(content), observed)
 
                                 lock.release(force=True)
 
-                if self._file_modified_future is None:
-                    await asyncio.sleep(self._args.sleep_interval)
+                if self._file_modified_futures[filename] is None:
+                    await self._wait_for_update(filename)
                 else:
                     try:
                         await asyncio.wait_for(
-                            self._file_modified_future, self._args.sleep_interval
+                            self._file_modified_futures[filename],
+                            self._args.sleep_interval,
                         )
                     except asyncio.TimeoutError:
                         continue
@@ -358,6 +1305,104 @@ class FileBus:
                     pass
 
 
+def _print_histogram(label, latencies, file):
+    latencies = sorted(latencies)
+    print(
+        "{}: count={} min={:.6f} median={:.6f} max={:.6f}".format(
+            label,
+            len(latencies),
+            latencies[0],
+            latencies[len(latencies) // 2],
+            latencies[-1],
+        ),
+        file=file,
+    )
+    counts = [0] * len(TRACE_BUCKETS)
+    for latency in latencies:
+        for i, (bound, _bucket_label) in enumerate(TRACE_BUCKETS):
+            if latency < bound:
+                counts[i] += 1
+                break
+    for count, (_bound, bucket_label) in zip(counts, TRACE_BUCKETS):
+        if count:
+            print(
+                "  {:>8} {:>8} {}".format(
+                    bucket_label, count, "#" * max(1, 40 * count // len(latencies))
+                ),
+                file=file,
+            )
+
+
+def trace_report(trace_files, file=None):
+    """
+    Print per-stage latency histograms for chunks recorded by --trace,
+    joining producer and consumer records on their chunk key.
+    """
+    if file is None:
+        file = sys.stdout
+
+    producers = {}
+    consumers = []
+    stalls = []
+    for trace_file in trace_files:
+        with open(trace_file, "rt") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "stall" in record:
+                    stalls.append(record["stall"])
+                elif record["role"] == "producer":
+                    producers[record["chunk"]] = record["stages"]
+                else:
+                    consumers.append(record)
+
+    latencies = {}
+    end_to_end = []
+
+    def add_timeline(stages, first_stage="read"):
+        timeline = [
+            stage
+            for stage in TRACE_STAGES[TRACE_STAGES.index(first_stage) :]
+            if stages.get(stage) is not None
+        ]
+        for previous, stage in zip(timeline, timeline[1:]):
+            latencies.setdefault((previous, stage), []).append(
+                stages[stage] - stages[previous]
+            )
+
+    for stages in producers.values():
+        add_timeline(stages)
+
+    for record in consumers:
+        stages = dict(record["stages"])
+        producer_stages = producers.get(record["chunk"])
+        if producer_stages is None:
+            add_timeline(stages)
+            continue
+        stages.update(producer_stages)
+        # Producer stages have already been counted once per chunk.
+        add_timeline(stages, first_stage="renamed")
+        first = next(stages[x] for x in TRACE_STAGES if stages.get(x) is not None)
+        if stages.get("written") is not None:
+            end_to_end.append(stages["written"] - first)
+
+    for previous, stage in sorted(
+        latencies, key=lambda x: (TRACE_STAGES.index(x[0]), TRACE_STAGES.index(x[1]))
+    ):
+        _print_histogram(
+            "{} -> {}".format(previous, stage), latencies[(previous, stage)], file
+        )
+
+    if end_to_end:
+        _print_histogram("end-to-end", end_to_end, file)
+
+    if stalls:
+        _print_histogram("event loop stalls", stalls, file)
+
+    return 0
+
+
 def numeric_arg(arg):
     if not isinstance(arg, str):
         return arg
@@ -374,6 +1419,20 @@ def numeric_arg(arg):
     raise TypeError("Not a number: {}".format(arg))
 
 
+def byte_range_arg(arg):
+    start, sep, end = arg.partition(":")
+    if not sep:
+        raise TypeError("Not a byte range: {}".format(arg))
+    return (int(start) if start else None, int(end) if end else None)
+
+
+def output_arg(arg):
+    policy, sep, target = arg.partition(":")
+    if sep and policy in OUTPUT_POLICIES:
+        return (policy, target)
+    return (OUTPUT_POLICIES[0], arg)
+
+
 def parse_args(argv=None):
     if argv is None:
         argv = sys.argv
@@ -437,6 +1496,14 @@ def parse_args(argv=None):
         help="disable filesystem event monitoring",
     )
 
+    root_parser.add_argument(
+        "--notify",
+        action="store_true",
+        dest="notify",
+        default=False,
+        help="ring and wait on FIFO doorbells in FILE.notify instead of polling (the sleep interval remains a safety net)",
+    )
+
     root_parser.add_argument(
         "--filename",
         action="store",
@@ -445,6 +1512,15 @@ def parse_args(argv=None):
         help="path of the data file (the producer updates it via atomic rename)",
     )
 
+    root_parser.add_argument(
+        "--partitions",
+        action="store",
+        metavar="N",
+        type=int,
+        default=None,
+        help="map the bus to N partition files named FILE.0 through FILE.N-1",
+    )
+
     root_parser.add_argument(
         "--sleep-interval",
         action="store",
@@ -454,6 +1530,25 @@ def parse_args(argv=None):
         help="check for new messages at least once every N seconds",
     )
 
+    root_parser.add_argument(
+        "--stall-threshold",
+        action="store",
+        metavar="N",
+        type=numeric_arg,
+        default=None,
+        help="report event loop stalls of at least N seconds (default {} with --trace)".format(
+            STALL_THRESHOLD
+        ),
+    )
+
+    root_parser.add_argument(
+        "--trace",
+        action="store",
+        metavar="FILE",
+        default=None,
+        help="append per-chunk stage timestamps to FILE in JSON-lines format",
+    )
+
     root_parser.add_argument(
         "-v",
         "--verbose",
@@ -475,10 +1570,128 @@ def parse_args(argv=None):
         default=None,
         help="blocking read from input (clear the O_NONBLOCK flag)",
     )
+    producer_parser.add_argument(
+        "--no-bulk-ingest",
+        action="store_false",
+        dest="bulk_ingest",
+        default=True,
+        help="read a regular file input in a loop instead of copying block sized ranges of it in the kernel",
+    )
+    producer_parser.add_argument(
+        "--write-queue-depth",
+        action="store",
+        metavar="N",
+        type=int,
+        default=WRITE_QUEUE_DEPTH,
+        help="maximum number of chunks queued for the writer thread while the next chunk is read (0 disables double buffering)",
+    )
+    producer_parser.add_argument(
+        "--spool-dir",
+        action="store",
+        metavar="DIR",
+        default=None,
+        help="with --back-pressure, continue to read input into a spool file in DIR while waiting for consumers",
+    )
+    producer_parser.add_argument(
+        "--spool-max-bytes",
+        action="store",
+        metavar="N",
+        type=int,
+        default=SPOOL_MAX_BYTES,
+        help="stop reading input when the spool holds at least N bytes",
+    )
+    producer_parser.add_argument(
+        "--record-delimiter",
+        action="store",
+        metavar="DELIM",
+        type=os.fsencode,
+        default=b"\n",
+        help="with --partitions, route records terminated by DELIM (default newline)",
+    )
+    producer_parser.add_argument(
+        "--max-record-size",
+        action="store",
+        metavar="N",
+        type=int,
+        default=MAX_RECORD_SIZE,
+        help="with --partitions, route an incomplete record once it reaches N bytes without a delimiter",
+    )
+    partition_key_group = producer_parser.add_mutually_exclusive_group()
+    partition_key_group.add_argument(
+        "--partition-key-field",
+        action="store",
+        metavar="N",
+        type=int,
+        default=None,
+        help="with --partitions, use the zero-based field N of each record as the partition key",
+    )
+    partition_key_group.add_argument(
+        "--partition-key-bytes",
+        action="store",
+        metavar="START:END",
+        type=byte_range_arg,
+        default=None,
+        help="with --partitions, use a byte range of each record as the partition key",
+    )
+    producer_parser.add_argument(
+        "--partition-field-delimiter",
+        action="store",
+        metavar="DELIM",
+        type=os.fsencode,
+        default=b"\t",
+        help="field delimiter for --partition-key-field (default tab)",
+    )
     consumer_parser = subparsers.add_parser(
         "consumer", help="connect consumer side of stream"
     )
     consumer_parser.set_defaults(func=lambda args: setattr(args, "command", "consumer"))
+    consumer_parser.add_argument(
+        "--partition",
+        action="append",
+        metavar="I",
+        type=int,
+        default=None,
+        help="with --partitions, consume partition I (may be repeated, default all partitions)",
+    )
+    consumer_parser.add_argument(
+        "--output",
+        action="append",
+        metavar="[POLICY:]FD|PATH",
+        type=output_arg,
+        default=None,
+        help="write chunks to a file descriptor, file or FIFO instead of stdout (may be repeated), "
+        "where POLICY for a full output buffer is one of {} (default {})".format(
+            ", ".join(OUTPUT_POLICIES), OUTPUT_POLICIES[0]
+        ),
+    )
+    consumer_parser.add_argument(
+        "--output-drain-timeout",
+        action="store",
+        metavar="N",
+        type=numeric_arg,
+        default=OUTPUT_DRAIN_TIMEOUT,
+        help="at EOF, discard the buffer of an --output which makes no progress for N seconds (ignored with --back-pressure)",
+    )
+    consumer_parser.add_argument(
+        "--output-buffer-size",
+        action="store",
+        metavar="N",
+        type=int,
+        default=OUTPUT_BUFFER_SIZE,
+        help="maximum number of bytes buffered for each --output",
+    )
+    trace_report_parser = subparsers.add_parser(
+        "trace-report", help="print latency histograms for --trace files"
+    )
+    trace_report_parser.set_defaults(
+        func=lambda args: setattr(args, "command", "trace-report")
+    )
+    trace_report_parser.add_argument(
+        "trace_files",
+        metavar="FILE",
+        nargs="+",
+        help="trace file written by --trace",
+    )
 
     args = root_parser.parse_args(argv[1:])
     args.func(args)
@@ -488,11 +1701,34 @@ def parse_args(argv=None):
             current_parser = consumer_parser
         elif getattr(args, "command", None) == "producer":
             current_parser = producer_parser
+        elif getattr(args, "command", None) == "trace-report":
+            current_parser = trace_report_parser
         else:
             current_parser = root_parser
         current_parser.print_help()
         current_parser.exit()
 
+    if getattr(args, "spool_dir", None) and not args.back_pressure:
+        root_parser.error("--spool-dir requires --back-pressure")
+    if args.stall_threshold is not None and args.stall_threshold <= 0:
+        root_parser.error("--stall-threshold must be greater than 0")
+    if args.back_pressure and len(getattr(args, "output", None) or ()) > 1:
+        root_parser.error(
+            "--back-pressure does not support multiple --output options, since a slow output drops chunks"
+        )
+    if args.partitions is not None and args.partitions < 1:
+        root_parser.error("--partitions must be at least 1")
+    for option in ("record_delimiter", "partition_field_delimiter"):
+        if getattr(args, option, None) == b"":
+            root_parser.error(
+                "--{} must not be empty".format(option.replace("_", "-"))
+            )
+    if getattr(args, "max_record_size", 1) < 1:
+        root_parser.error("--max-record-size must be at least 1")
+    for index in getattr(args, "partition", None) or ():
+        if args.partitions is None or not 0 <= index < args.partitions:
+            root_parser.error("--partition {} is out of range".format(index))
+
     logging.basicConfig(
         level=(logging.getLogger().getEffectiveLevel() - 10 * args.verbosity),
         format="[%(levelname)-4s] %(message)s",
@@ -537,6 +1773,10 @@ def main(argv=None):
         argv = sys.argv
 
     args = parse_args(argv=argv)
+    # Only the python implementation reads trace files.
+    if getattr(args, "command", None) == "trace-report":
+        return trace_report(args.trace_files)
+
     if args.impl == "bash":
         new_argv = filebus_bash_impl(argv[1:])
         os.execvp(new_argv[0], new_argv)
@@ -1,7 +1,12 @@
 import asyncio
+import contextlib
+import glob
+import io
 import os
+import shutil
 import sys
 import tempfile
+import time
 import unittest
 
 try:
@@ -41,13 +46,136 @@ class FileBusTest(unittest.TestCase):
     def test_filebus_blocking_read(self):
         asyncio_run(self._test_async(force_blocking_read=True))
 
-    async def _test_async(self, back_pressure=True, force_blocking_read=False):
+    def test_filebus_trace(self):
+        if self.impl != "python":
+            self.skipTest("--trace is only supported by the python implementation")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            trace_file = os.path.join(tmpdir, "trace.jsonl")
+            asyncio_run(self._test_async(extra_args=["--trace", trace_file]))
+            output = io.StringIO()
+            self.assertEqual(filebus.trace_report([trace_file], file=output), 0)
+            output = output.getvalue()
+            self.assertIn("flush_start -> lock_acquired", output)
+            self.assertIn("renamed -> observed", output)
+            self.assertIn("end-to-end: count=1", output)
+
+    def test_filebus_write_queue_depth(self):
+        if self.impl != "python":
+            self.skipTest(
+                "--write-queue-depth is only supported by the python implementation"
+            )
+        input_string = b"".join(b"%04d\n" % i for i in range(800))
+        for depth in (0, 2):
+            asyncio_run(
+                self._test_async(
+                    input_string=input_string,
+                    producer_extra_args=["--write-queue-depth={}".format(depth)],
+                )
+            )
+
+    def test_filebus_notify(self):
+        if self.impl != "python":
+            self.skipTest("--notify is only supported by the python implementation")
+        input_string = b"".join(b"%04d\n" % i for i in range(800))
+        # With a long sleep interval, only the doorbells wake the waiters
+        # in time.
+        start_time = time.monotonic()
+        asyncio_run(
+            self._test_async(
+                input_string=input_string,
+                extra_args=["--notify", "--no-file-monitoring"],
+                sleep_interval=30,
+            )
+        )
+        self.assertLess(time.monotonic() - start_time, 20)
+
+    def test_filebus_spool(self):
+        if self.impl != "python":
+            self.skipTest("--spool-dir is only supported by the python implementation")
+        input_string = b"".join(b"%04d\n" % i for i in range(800))
+        with tempfile.TemporaryDirectory() as spool_dir:
+            asyncio_run(
+                self._test_async(
+                    input_string=input_string,
+                    producer_extra_args=[
+                        "--spool-dir",
+                        spool_dir,
+                        "--spool-max-bytes=2048",
+                    ],
+                )
+            )
+            self.assertEqual([], os.listdir(spool_dir))
+
+    def test_filebus_partitions(self):
+        if self.impl != "python":
+            self.skipTest("--partitions is only supported by the python implementation")
+        input_string = b"".join(b"key%d,%04d\n" % (i % 5, i) for i in range(400))
+
+        def records_by_key(data):
+            records = {}
+            for record in data.splitlines(keepends=True):
+                records.setdefault(record.split(b",")[0], []).append(record)
+            return records
+
+        asyncio_run(
+            self._test_async(
+                input_string=input_string,
+                extra_args=["--partitions=3"],
+                producer_extra_args=[
+                    "--partition-key-field=0",
+                    "--partition-field-delimiter=,",
+                ],
+                normalize_result=records_by_key,
+            )
+        )
+
+    def test_filebus_outputs(self):
+        if self.impl != "python":
+            self.skipTest("--output is only supported by the python implementation")
+        input_string = b"".join(b"%04d\n" % i for i in range(400))
+        # The output path is opened like a shell redirection would.
+        asyncio_run(
+            self._test_async(
+                input_string=input_string,
+                consumer_extra_args=["--output=drop-old:/dev/stdout"],
+            )
+        )
+
+    def test_filebus_bulk_ingest(self):
+        if self.impl != "python":
+            self.skipTest("bulk ingest is only supported by the python implementation")
+        input_string = b"".join(b"%04d\n" % i for i in range(800))
+        with tempfile.TemporaryFile() as producer_log:
+            asyncio_run(
+                self._test_async(
+                    input_string=input_string,
+                    stdin_file=True,
+                    producer_log=producer_log,
+                )
+            )
+            producer_log.seek(0)
+            self.assertIn(
+                b"bulk ingest: %d bytes in" % len(input_string), producer_log.read()
+            )
+
+    async def _test_async(
+        self,
+        back_pressure=True,
+        force_blocking_read=False,
+        extra_args=(),
+        producer_extra_args=(),
+        consumer_extra_args=(),
+        stdin_file=False,
+        producer_log=None,
+        sleep_interval=0.1,
+        input_string=b"hello world\n",
+        normalize_result=lambda data: data,
+    ):
         data_file = tempfile.NamedTemporaryFile(delete=False).__enter__()
         try:
             if back_pressure:
                 os.unlink(data_file.name)
 
-            input_string = b"hello world\n"
             producer_args = (
                 [
                     sys.executable,
@@ -56,14 +184,17 @@ class FileBusTest(unittest.TestCase):
                     self.impl,
                 ]
                 + (["--back-pressure"] if back_pressure else [])
+                + (["-v"] if producer_log is not None else [])
+                + list(extra_args)
                 + [
                     "--block-size=512",
-                    "--sleep-interval=0.1",
+                    "--sleep-interval={}".format(sleep_interval),
                     "--filename",
                     data_file.name,
                     "producer",
                 ]
                 + (["--blocking-read"] if force_blocking_read else [])
+                + list(producer_extra_args)
             )
 
             consumer_args = (
@@ -74,19 +205,31 @@ class FileBusTest(unittest.TestCase):
                     self.impl,
                 ]
                 + (["--back-pressure"] if back_pressure else [])
+                + list(extra_args)
                 + [
-                    "--sleep-interval=0.1",
+                    "--sleep-interval={}".format(sleep_interval),
                     "--filename",
                     data_file.name,
                     "consumer",
                 ]
+                + list(consumer_extra_args)
             )
 
-            pr, pw = os.pipe()
-            consumer_proc = await self._subprocess("producer", producer_args, pr, pw)
-            os.close(pr)
-            os.write(pw, input_string)
-            os.close(pw)
+            if stdin_file:
+                with tempfile.TemporaryFile() as stdin:
+                    stdin.write(input_string)
+                    stdin.seek(0)
+                    consumer_proc = await self._subprocess(
+                        "producer", producer_args, stdin.fileno(), None, producer_log
+                    )
+            else:
+                pr, pw = os.pipe()
+                consumer_proc = await self._subprocess(
+                    "producer", producer_args, pr, pw, producer_log
+                )
+                os.close(pr)
+                os.write(pw, input_string)
+                os.close(pw)
 
             pr, pw = os.pipe()
             producer_proc = await self._subprocess("consumer", consumer_args, pr, pw)
@@ -103,9 +246,16 @@ class FileBusTest(unittest.TestCase):
             finally:
                 if not loop.is_closed():
                     loop.remove_reader(pr)
-            result = os.read(pr, len(input_string))
+            result = b""
+            while len(result) < len(input_string):
+                chunk = os.read(pr, len(input_string) - len(result))
+                if not chunk:
+                    break
+                result += chunk
             os.close(pr)
-            self.assertEqual(result, input_string)
+            self.assertEqual(
+                normalize_result(result), normalize_result(input_string)
+            )
 
             await consumer_proc.wait()
             await producer_proc.wait()
@@ -117,12 +267,18 @@ class FileBusTest(unittest.TestCase):
                 os.unlink(data_file.name)
             except OSError:
                 pass
+            # Doorbells remove their notify directories when they close.
+            notify_dirs = glob.glob(glob.escape(data_file.name) + "*.notify")
+            for notify_dir in notify_dirs:
+                shutil.rmtree(notify_dir)
+            self.assertEqual([], notify_dirs)
 
-    async def _subprocess(self, command, args, pr, pw):
+    async def _subprocess(self, command, args, pr, pw, log=None):
         proc = await asyncio.create_subprocess_exec(
             *args,
             stdin=pr if command == "producer" else None,
-            stdout=pw if command == "consumer" else None
+            stdout=pw if command == "consumer" else None,
+            stderr=log
         )
         return proc
 
@@ -131,5 +287,218 @@ class FileBusBashTest(FileBusTest):
     impl = "bash"
 
 
+class MainTest(unittest.TestCase):
+    def test_trace_report_bash_impl(self):
+        # The bash implementation would replace this process via exec.
+        with tempfile.NamedTemporaryFile() as trace_file:
+            self.assertEqual(
+                filebus.main(
+                    ["filebus", "--impl", "bash", "trace-report", trace_file.name]
+                ),
+                0,
+            )
+
+    def test_stall_threshold_positive(self):
+        for threshold in ("0", "-1"):
+            with self.assertRaises(SystemExit):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    filebus.parse_args(
+                        [
+                            "filebus",
+                            "--stall-threshold",
+                            threshold,
+                            "--filename",
+                            "bus",
+                            "consumer",
+                        ]
+                    )
+
+    def test_partition_args(self):
+        for producer_args in (
+            ["--record-delimiter", ""],
+            ["--partition-key-field", "0", "--partition-field-delimiter", ""],
+            ["--max-record-size", "0"],
+        ):
+            with self.assertRaises(SystemExit):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    filebus.parse_args(
+                        ["filebus", "--partitions", "2", "--filename", "bus", "producer"]
+                        + producer_args
+                    )
+
+
+class DoorbellTest(unittest.TestCase):
+    def test_lossy_producer_notify(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "bus")
+            args = filebus.parse_args(
+                ["filebus", "--notify", "--filename", filename, "producer"]
+            )
+            with filebus.FileBus(args):
+                # A lossy producer never waits, so it has no doorbell.
+                self.assertFalse(os.path.exists(filename + ".notify"))
+
+    def test_doorbell_close(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "bus")
+            doorbells = [filebus.Doorbell([filename]) for _ in range(2)]
+            for doorbell in doorbells:
+                doorbell.open()
+            doorbells[0].close()
+            self.assertEqual(len(os.listdir(filename + ".notify")), 1)
+            # The last doorbell removes the empty directory.
+            doorbells[1].close()
+            self.assertFalse(os.path.exists(filename + ".notify"))
+
+
+class FileRangeTest(unittest.TestCase):
+    def test_file_range_copy_to(self):
+        with tempfile.TemporaryFile() as src, tempfile.TemporaryFile() as dest:
+            src.write(b"0123456789")
+            src.flush()
+            file_range = filebus.FileRange(src.fileno(), 2, 5)
+            self.assertEqual(file_range.copy_to(dest.fileno()), 5)
+            dest.seek(0)
+            self.assertEqual(dest.read(), b"23456")
+
+    def test_file_range_truncated(self):
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryFile() as src:
+            src.write(b"0123")
+            src.flush()
+            filename = os.path.join(tmpdir, "bus")
+            args = filebus.parse_args(["filebus", "--filename", filename, "producer"])
+            # A range past the end of the file is not published, since
+            # an empty chunk is the EOF marker.
+            bus = filebus.FileBus(args)
+            bus._write_chunk(filename, filebus.FileRange(src.fileno(), 4, 6))
+            self.assertFalse(os.path.exists(filename))
+            self.assertEqual(bus._bulk_ingest_end, 4)
+
+            bus = filebus.FileBus(args)
+            bus._write_chunk(filename, filebus.FileRange(src.fileno(), 0, 10))
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), b"0123")
+            self.assertEqual(bus._bulk_ingest_end, 4)
+            # The read loop publishes the rest of a truncated file.
+            os.unlink(filename)
+            bus._write_chunk(filename, filebus.FileRange(src.fileno(), 0, 4))
+            self.assertFalse(os.path.exists(filename))
+
+
+class SpoolTest(unittest.TestCase):
+    def test_spool_disk_size_bounded(self):
+        segment_size = 16384
+        chunk = os.urandom(4096)
+        with tempfile.TemporaryDirectory() as spool_dir:
+            spool = filebus.Spool(spool_dir, segment_size=segment_size)
+            try:
+                # Keep one chunk queued, so that the spool never empties.
+                pending = [spool.append(chunk)]
+                for _ in range(1000):
+                    pending.append(spool.append(chunk))
+                    self.assertEqual(spool.pop(pending.pop(0)), chunk)
+                    self.assertEqual(spool.size, len(chunk))
+                self.assertLessEqual(spool.disk_size(), 2 * segment_size)
+            finally:
+                spool.close()
+
+
+class SinkTest(unittest.TestCase):
+    def test_sinks(self):
+        chunks = [b"%04d\n" % i for i in range(400)]
+
+        async def write_sinks(fast_fd, slow_fd):
+            fast = filebus.Sink(str(fast_fd), "drop", 65536)
+            slow = filebus.Sink(str(slow_fd), "drop-old", 64)
+            fast.open()
+            slow.open()
+            try:
+                for chunk in chunks:
+                    fast.write(chunk)
+                    slow.write(chunk)
+                await fast.drain(10)
+                # Nothing reads the slow sink, so it is discarded.
+                await slow.drain(0.1)
+                self.assertEqual(slow.has_room(), True)
+                with self.assertLogs(level="WARNING") as logs:
+                    slow.close()
+                self.assertIn("after the drain timeout", logs.output[-1])
+            finally:
+                fast.close()
+                slow.close()
+
+        fast_r, fast_w = os.pipe()
+        slow_r, slow_w = os.pipe()
+        try:
+            # Fill the slow pipe, so that the slow sink is stuck.
+            os.set_blocking(slow_w, False)
+            try:
+                while True:
+                    os.write(slow_w, b"x" * 65536)
+            except BlockingIOError:
+                pass
+            asyncio_run(write_sinks(fast_w, slow_w))
+            os.close(fast_w)
+            fast_w = None
+            with os.fdopen(fast_r, "rb") as f:
+                fast_r = None
+                self.assertEqual(f.read(), b"".join(chunks))
+        finally:
+            for fd in (fast_r, fast_w, slow_r, slow_w):
+                if fd is not None:
+                    os.close(fd)
+
+    def test_sink_drain_without_timeout(self):
+        data = os.urandom(500000)
+
+        async def write_sink(read_fd, write_fd, received):
+            loop = get_running_loop()
+            sink = filebus.Sink(str(write_fd), "drop", len(data))
+            sink.open()
+            try:
+                sink.write(data)
+                # The reader pauses, and the sink waits for it.
+                loop.call_later(
+                    0.5,
+                    loop.add_reader,
+                    read_fd,
+                    lambda: received.extend(os.read(read_fd, 65536)),
+                )
+                await sink.drain()
+            finally:
+                loop.remove_reader(read_fd)
+                sink.close()
+
+        pr, pw = os.pipe()
+        try:
+            received = bytearray()
+            asyncio_run(write_sink(pr, pw, received))
+            os.close(pw)
+            pw = None
+            with os.fdopen(pr, "rb") as f:
+                pr = None
+                received.extend(f.read())
+            self.assertEqual(bytes(received), data)
+        finally:
+            for fd in (pr, pw):
+                if fd is not None:
+                    os.close(fd)
+
+    def test_back_pressure_multiple_outputs(self):
+        with self.assertRaises(SystemExit):
+            with contextlib.redirect_stderr(io.StringIO()):
+                filebus.parse_args(
+                    [
+                        "filebus",
+                        "--back-pressure",
+                        "--filename",
+                        "bus",
+                        "consumer",
+                        "--output=1",
+                        "--output=2",
+                    ]
+                )
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)